@@ -0,0 +1,176 @@
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from generators import GENERATORS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'baseline.json')
+
+
+def step_duration(name):
+    return 61 + int(name[1:]) % 26
+
+
+# case name -> (puzzle, function of the loaded module and the input file)
+CASES = {
+    'p1a': ('p1', lambda p1, fname: p1.p1a_stream(fname)),
+    'p1b': ('p1', lambda p1, fname: p1.p1b(p1.read_p1_input(fname))),
+    'p6a': ('p6', lambda p6, fname: p6.p6a(p6.parse_p6_input(fname))),
+    'p6b': ('p6', lambda p6, fname: p6.p6b(p6.parse_p6_input(fname), 10000)),
+    'p7a': ('p7', lambda p7, fname: p7.p7a(p7.parse_p7_input(fname))),
+    'p7b': ('p7', lambda p7, fname: p7.schedule(
+        p7.build_dependencies(p7.parse_p7_input(fname)), 5, step_duration)[0]),
+    'p8': ('p8', lambda p8, fname: p8.Tree(p8.parse_p8_input(fname)).evaluate()),
+    'p8_stream': ('p8', lambda p8, fname: p8.p8_stream(fname)),
+    'p8_deep': ('p8', lambda p8, fname: p8.Tree(p8.parse_p8_input(fname)).evaluate()),
+    'p15a': ('p15', lambda p15, fname: p15.p15a(p15.parse_p15_input(fname))),
+    'p15b': ('p15', lambda p15, fname: p15.find_elf_power(
+        p15.parse_p15_input(fname), max_workers=1)),
+    'p17': ('p17', lambda p17, fname: p17.p17a(*p17.parse_p17_input(fname))),
+    'p17_sparse': ('p17', lambda p17, fname: p17.p17a(*p17.parse_p17_input(fname),
+                                                      sparse=True)),
+}
+# cases generating their input other than the puzzle's default way
+CASE_INPUTS = {'p8_deep': 'p8_deep'}
+
+
+def run_case(case, fname, repeat=1):
+    # runs in a fresh process, so peak RSS belongs to this case alone; the
+    # best of several runs is the least disturbed by the rest of the machine
+    puzzle, solve = CASES[case]
+    sys.path.insert(0, os.path.join(REPO_DIR, puzzle))
+    module = importlib.import_module(puzzle)
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        solve(module, fname)
+        seconds.append(time.perf_counter() - start)
+    return {'seconds': min(seconds), 'peak_rss': peak_rss()}
+
+
+def peak_rss():
+    # ru_maxrss survives fork and exec, so it would include the parent's
+    # peak; the kernel's high-water mark for this address space doesn't
+    try:
+        with open('/proc/self/status') as fileobj:
+            for line in fileobj:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_suite(cases, scales, seed=0, repeat=1):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case in cases:
+            kind = CASE_INPUTS.get(case, CASES[case][0])
+            for scale in scales:
+                fname = os.path.join(tmp_dir, '%s_%d.txt' % (kind, scale))
+                if not os.path.exists(fname):
+                    rng = np.random.default_rng(seed)
+                    with open(fname, 'w') as fileobj:
+                        fileobj.write(GENERATORS[kind](rng, scale))
+                with ProcessPoolExecutor(1, multiprocessing.get_context('spawn'),
+                                         max_tasks_per_child=1) as executor:
+                    result = executor.submit(run_case, case, fname, repeat).result()
+                result['input_bytes'] = os.path.getsize(fname)
+                results['%s@%d' % (case, scale)] = result
+    return results
+
+
+def scaling_exponents(results, cases, scales):
+    # slope of log(time) against log(scale) between neighbouring scales
+    exponents = {}
+    for case in cases:
+        times = [results['%s@%d' % (case, scale)]['seconds'] for scale in scales]
+        exponents[case] = [np.log(t1 / t0) / np.log(s1 / s0) for t0, t1, s0, s1
+                           in zip(times, times[1:], scales, scales[1:])]
+    return exponents
+
+
+def find_regressions(results, baseline, tolerance, min_change=None):
+    # a regression has to be both relatively and absolutely large, so tiny
+    # cases don't fail on timer noise
+    min_change = min_change or {'seconds': 0.01, 'peak_rss': 1e6}
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric in ('seconds', 'peak_rss'):
+            old = baseline[key][metric]
+            if result[metric] > old * (1 + tolerance) and \
+                    result[metric] - old > min_change[metric]:
+                regressions.append((key, metric, old, result[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time the puzzle solutions on generated inputs.')
+    parser.add_argument('--cases', default=','.join(CASES),
+                        help='comma-separated cases (default: all)')
+    parser.add_argument('--scales', default='10,100',
+                        help='input sizes relative to the official input, '
+                             'e.g. 10,100,1000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown or memory growth over baseline')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per case; the fastest one is reported')
+    parser.add_argument('--min-seconds', type=float, default=0.01,
+                        help='ignore slowdowns smaller than this')
+    parser.add_argument('--min-mb', type=float, default=1.0,
+                        help='ignore memory growth smaller than this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    cases = args.cases.split(',')
+    scales = [int(scale) for scale in args.scales.split(',')]
+    results = run_suite(cases, scales, args.seed, args.repeat)
+
+    print('%-16s %10s %12s %12s' % ('case', 'seconds', 'peak MB', 'input MB'))
+    for key, result in results.items():
+        print('%-16s %10.3f %12.1f %12.2f' % (key, result['seconds'],
+                                             result['peak_rss'] / 1e6,
+                                             result['input_bytes'] / 1e6))
+    if len(scales) > 1:
+        print('\nscaling exponents (time ~ scale^k)')
+        for case, exponents in scaling_exponents(results, cases, scales).items():
+            print('%-16s %s' % (case, ' '.join('%.2f' % k for k in exponents)))
+    if args.json:
+        with open(args.json, 'w') as fileobj:
+            json.dump(results, fileobj, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fileobj:
+            json.dump(results, fileobj, indent=2)
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as fileobj:
+        regressions = find_regressions(
+            results, json.load(fileobj), args.tolerance,
+            {'seconds': args.min_seconds, 'peak_rss': args.min_mb * 1e6})
+    for key, metric, old, new in regressions:
+        print('REGRESSION %s %s: %.4g -> %.4g' % (key, metric, old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
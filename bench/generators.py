@@ -0,0 +1,99 @@
+import numpy as np
+
+# each generator takes a seeded numpy Generator and a scale relative to the
+# size of the official puzzle input, and returns the input file's text
+
+
+def gen_p1(rng, scale):
+    # many large changes with a small net drift, so p1b needs many passes
+    changes = rng.integers(-100000, 100000, 1000 * scale)
+    changes[-1] -= np.sum(changes) - rng.integers(1, 50)
+    return ''.join('%+d\n' % change for change in changes)
+
+
+def gen_p6(rng, scale):
+    n_points = 50 * scale
+    span = int(400 * np.sqrt(scale))
+    points = rng.integers(0, span, (n_points, 2))
+    return ''.join('%d, %d\n' % tuple(point) for point in points)
+
+
+def gen_p7(rng, scale):
+    # a random DAG over numbered steps, about four prerequisites each
+    n_steps = 26 * scale
+    names = ['S%07d' % ind for ind in range(n_steps)]
+    lines = []
+    for step in range(1, n_steps):
+        for prereq in set(rng.integers(0, step, min(step, 4)).tolist()):
+            lines.append('Step %s must be finished before step %s can begin.\n'
+                         % (names[prereq], names[step]))
+    return ''.join(lines)
+
+
+def gen_p8(rng, scale, deep=False):
+    # a license tree of 2000 nodes per unit of scale; each node hangs off a
+    # random earlier node, or off one of the last few for a deep tree
+    n_nodes = 2000 * scale
+    if deep:
+        parents = np.maximum(np.arange(n_nodes) - rng.integers(1, 3, n_nodes), 0)
+    else:
+        parents = (rng.random(n_nodes) * np.arange(n_nodes)).astype(int)
+    children = [[] for _ in range(n_nodes)]
+    for node, parent in enumerate(parents[1:].tolist(), start=1):
+        children[parent].append(node)
+    tokens = []
+    stack = [(0, 0)]
+    while stack:
+        node, n_done = stack.pop()
+        if not n_done:
+            tokens += [len(children[node]), 3]
+        if n_done < len(children[node]):
+            stack.append((node, n_done + 1))
+            stack.append((children[node][n_done], 0))
+        else:
+            # child references, some repeated and some out of range
+            tokens += rng.integers(1, len(children[node]) + 2, 3).tolist()
+    return ' '.join(map(str, tokens)) + '\n'
+
+
+def gen_p8_deep(rng, scale):
+    return gen_p8(rng, scale, deep=True)
+
+
+def gen_p15(rng, scale):
+    side = int(32 * np.sqrt(scale))
+    cave = rng.choice(np.array(list('#.EG')), (side, side),
+                      p=[0.12, 0.853, 0.012, 0.015])
+    cave[[0, -1], :] = '#'
+    cave[:, [0, -1]] = '#'
+    return ''.join(''.join(row) + '\n' for row in cave)
+
+
+def gen_p17(rng, scale):
+    # clay basins and shelves spread below the spring at x=500
+    height = 1900 * scale
+    half_width = int(120 * np.sqrt(scale))
+    lines = []
+    for _ in range(500 * scale):
+        left = int(rng.integers(500 - half_width, 500 + half_width))
+        y = int(rng.integers(10, height))
+        width = int(rng.integers(2, 20))
+        depth = int(rng.integers(1, 12))
+        if rng.random() < 0.8:
+            lines.append('x=%d, y=%d..%d\n' % (left, y - int(rng.integers(0, depth)), y + depth))
+            lines.append('x=%d, y=%d..%d\n' % (left + width, y - int(rng.integers(0, depth)), y + depth))
+            lines.append('y=%d, x=%d..%d\n' % (y + depth, left, left + width))
+        else:
+            lines.append('y=%d, x=%d..%d\n' % (y, left, left + width))
+    return ''.join(lines)
+
+
+GENERATORS = {
+    'p1': gen_p1,
+    'p6': gen_p6,
+    'p7': gen_p7,
+    'p8': gen_p8,
+    'p8_deep': gen_p8_deep,
+    'p15': gen_p15,
+    'p17': gen_p17,
+}
@@ -0,0 +1,26 @@
+import numpy as np
+
+CHUNK_SIZE = 1 << 24
+
+
+def iter_int_chunks(fname, chunk_size=CHUNK_SIZE):
+    # whitespace-separated integers as int64 arrays, read in fixed-size
+    # blocks; each block is cut after its last whitespace and the partial
+    # number carried over, so no number is split between two arrays
+    leftover = b''
+    with open(fname, 'rb') as fileobj:
+        while True:
+            block = fileobj.read(chunk_size)
+            if not block:
+                break
+            block = leftover + block
+            cut = max(block.rfind(b' '), block.rfind(b'\n')) + 1
+            leftover = block[cut:]
+            if cut:
+                yield parse_ints(block[:cut])
+    if leftover.strip():
+        yield parse_ints(leftover)
+
+
+def parse_ints(block):
+    return np.fromstring(block.decode('ascii'), dtype=np.int64, sep=' ')
@@ -0,0 +1,91 @@
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+import loader
+
+# hot functions to time per puzzle module; methods as 'Class.method'
+DEFAULT_TARGETS = {
+    'p6': ['label_cells', 'p6a', 'p6b', 'axis_distance_totals'],
+    'p7': ['topological_order', 'schedule', 'critical_path_length'],
+    'p8': ['Tree.parse', 'Tree.evaluate', 'p8_stream'],
+    'p15': ['Battle.execute_round', 'Battle.get_next_move', 'Battle.step_toward',
+            'find_nearest'],
+    'p17': ['flow_water', 'Grid.drop', 'Grid.spread', 'SparseGrid.drop',
+            'SparseGrid.spread'],
+}
+
+
+class Profile:
+    # call counts, cumulative and self times per function, work-unit
+    # counters reported by the modules, and self time per call stack
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = defaultdict(float)
+        self.counters = Counter()
+        self.stack_seconds = defaultdict(float)
+        self.stack = []
+
+    def wrap(self, name, function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            self.stack.append([name, 0.0])
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                _, child_seconds = self.stack[-1]
+                self.stack_seconds[';'.join(frame[0] for frame in self.stack)] += \
+                    elapsed - child_seconds
+                self.stack.pop()
+                if self.stack:
+                    self.stack[-1][1] += elapsed
+                self.calls[name] += 1
+                self.seconds[name] += elapsed
+        return timed
+
+    def stats(self):
+        return {
+            'calls': dict(self.calls),
+            'seconds': dict(self.seconds),
+            'counters': dict(self.counters),
+        }
+
+    def collapsed(self):
+        # one 'outer;inner microseconds' line per stack, the format
+        # flamegraph.pl and speedscope read
+        return ''.join('%s %d\n' % (stack, round(seconds * 1e6))
+                       for stack, seconds in sorted(self.stack_seconds.items()))
+
+
+@contextmanager
+def profiled(targets=None):
+    # while active, the target functions are timed and each module's
+    # COUNTERS hook is set to the profile's Counter, which the hot loops
+    # add their work units to; outside it the hooks are None and the
+    # modules run untouched. Only this process is profiled: work done in
+    # pool workers (p6 tiled runs, p15b with max_workers > 1) isn't counted
+    targets = DEFAULT_TARGETS if targets is None else targets
+    profile = Profile()
+    patched = []
+    try:
+        for puzzle, names in targets.items():
+            module = loader.import_puzzle(puzzle)
+            if hasattr(module, 'COUNTERS'):
+                patched.append((module, 'COUNTERS', module.COUNTERS))
+                module.COUNTERS = profile.counters
+            for name in names:
+                owner = module
+                *path, attr = name.split('.')
+                for part in path:
+                    owner = getattr(owner, part)
+                original = owner.__dict__[attr] if isinstance(owner, type) \
+                    else getattr(owner, attr)
+                patched.append((owner, attr, original))
+                setattr(owner, attr, profile.wrap('%s.%s' % (puzzle, name), original))
+        yield profile
+    finally:
+        for owner, attr, original in reversed(patched):
+            setattr(owner, attr, original)
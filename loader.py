@@ -0,0 +1,129 @@
+import hashlib
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get('AOC_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'aoc2018'))
+MAX_CACHE_BYTES = 1 << 30
+# bump when a parser's output changes so stale entries are never read back
+CACHE_VERSION = 1
+
+
+def import_puzzle(puzzle):
+    # the puzzle modules live in their own directories, e.g. p7/p7.py
+    puzzle_dir = os.path.join(REPO_DIR, puzzle)
+    if puzzle_dir not in sys.path:
+        sys.path.insert(0, puzzle_dir)
+    return importlib.import_module(puzzle)
+
+
+def encode_array(parsed):
+    return {'data': parsed}
+
+
+def decode_array(arrays):
+    return arrays['data']
+
+
+def encode_p7(parsed):
+    names, edges = parsed
+    return {'names': names, 'edges': edges}
+
+
+def decode_p7(arrays):
+    return arrays['names'], arrays['edges']
+
+
+def encode_p17(parsed):
+    veins, bounds = parsed
+    vein_array = np.array([vein['x'] + vein['y'] for vein in veins],
+                          dtype=np.int64).reshape([-1, 4])
+    return {'veins': vein_array,
+            'bounds': np.array([bounds['x'], bounds['y']], dtype=np.int64)}
+
+
+def decode_p17(arrays):
+    veins = [{'x': (int(x0), int(x1)), 'y': (int(y0), int(y1))}
+             for x0, x1, y0, y1 in arrays['veins'].tolist()]
+    bounds = {'x': arrays['bounds'][0].tolist(), 'y': arrays['bounds'][1].tolist()}
+    return veins, bounds
+
+
+# puzzle -> (parser name, encode to named arrays, decode from named arrays)
+LOADERS = {
+    'p1': ('read_p1_input', encode_array, decode_array),
+    'p6': ('parse_p6_input', encode_array, decode_array),
+    'p7': ('parse_p7_input', encode_p7, decode_p7),
+    'p8': ('parse_p8_input', encode_array, decode_array),
+    'p15': ('parse_p15_input', encode_array, decode_array),
+    'p17': ('parse_p17_input', encode_p17, decode_p17),
+}
+
+
+def load_input(puzzle, fname, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    # parse fname with the puzzle's parser, or reuse an earlier parse of
+    # the same file contents; cached arrays come back memory-mapped and
+    # read-only, so other processes share the same pages
+    parser_name, encode, decode = LOADERS[puzzle]
+    entry = os.path.join(cache_dir, '%s-v%d-%s' % (puzzle, CACHE_VERSION,
+                                                    hash_file(fname)))
+    if os.path.isdir(entry):
+        os.utime(entry)
+        return decode(read_entry(entry))
+    parsed = getattr(import_puzzle(puzzle), parser_name)(fname)
+    write_entry(entry, encode(parsed))
+    evict(cache_dir, max_bytes, keep=entry)
+    return parsed
+
+
+def hash_file(fname):
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as fileobj:
+        for block in iter(lambda: fileobj.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_entry(entry):
+    return {os.path.splitext(name)[0]: np.load(os.path.join(entry, name),
+                                               mmap_mode='r')
+            for name in os.listdir(entry)}
+
+
+def write_entry(entry, arrays):
+    # write into a scratch directory and rename it into place, so readers
+    # never see a half-written entry
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    scratch = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix='.tmp-')
+    for name, array in arrays.items():
+        np.save(os.path.join(scratch, name + '.npy'), np.asarray(array))
+    try:
+        os.rename(scratch, entry)
+    except OSError:
+        shutil.rmtree(scratch)  # another process got there first
+
+
+def evict(cache_dir, max_bytes, keep=None):
+    # drop least recently used entries until the cache fits in max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('.tmp-') or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, part))
+                   for part in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
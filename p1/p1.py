@@ -1,10 +1,53 @@
+import os
+import sys
+import time
+
 import numpy as np
 
+# the shared chunked reader lives at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunks import CHUNK_SIZE, iter_int_chunks  # noqa: E402
+
 
 def p1a(int_list):
     return np.sum(int_list)
 
-def p1b(int_list):
+def p1a_stream(fname, chunk_size=CHUNK_SIZE):
+    total = 0
+    for chunk in iter_int_chunks(fname, chunk_size):
+        total += int(np.sum(chunk, dtype=np.int64))
+    return total
+
+def p1b(int_list, reference=False):
+    if reference:
+        return p1b_loop(int_list)
+    sums = np.cumsum(int_list, dtype=np.int64)
+    if not len(sums):
+        return None
+    # a frequency repeated within the first pass is always found first
+    order = np.argsort(sums, kind='stable')
+    repeats = order[1:][sums[order[1:]] == sums[order[:-1]]]
+    if len(repeats):
+        return sums[np.min(repeats)]
+    drift = sums[-1]
+    if drift == 0:
+        return sums[0]  # every pass replays the first one exactly
+    # on pass k the running total after step i is sums[i] + k * drift, so it
+    # can only hit an earlier total from the same residue class, and the
+    # first one it hits is its nearest neighbour in the direction of drift
+    residues = sums % abs(drift)
+    order = np.lexsort((sums, residues))
+    lower, upper = order[:-1], order[1:]
+    same_class = residues[lower] == residues[upper]
+    lower, upper = lower[same_class], upper[same_class]
+    if not len(lower):
+        return None  # the totals drift apart forever
+    passes = (sums[upper] - sums[lower]) // abs(drift)
+    starts, values = (lower, sums[upper]) if drift > 0 else (upper, sums[lower])
+    first = np.argmin(passes * len(sums) + starts)
+    return values[first]
+
+def p1b_loop(int_list):
     current_val = 0
     seen_vals = set()
     while True:
@@ -19,7 +62,25 @@ def read_p1_input(fname):
     return np.loadtxt(fname, dtype=np.int32)
 
 
+def measure_p1a_throughput(fname, chunk_size=CHUNK_SIZE):
+    n_bytes = os.path.getsize(fname)
+    rates = {}
+    start = time.perf_counter()
+    p1a(read_p1_input(fname))
+    rates['loadtxt'] = n_bytes / 1e6 / (time.perf_counter() - start)
+    start = time.perf_counter()
+    p1a_stream(fname, chunk_size)
+    rates['stream'] = n_bytes / 1e6 / (time.perf_counter() - start)
+    return rates
+
+
+PARTS = {'a': p1a, 'b': p1b}
+
+
 if __name__ == '__main__':
     int_list = read_p1_input("p1_input.txt")
     print("p1a:", p1a(int_list))
     print("p1b:", p1b(int_list))
+    assert p1a_stream("p1_input.txt") == p1a(int_list)
+    for method, rate in measure_p1a_throughput("p1_input.txt").items():
+        print("p1a %s: %.1f MB/s" % (method, rate))
@@ -1,248 +1,382 @@
+import glob
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 
 CHAR_TO_INT = {'.': 0, 'E': 1, 'G': 2, '#': 3}
 INT_TO_CHAR = {val: key for key, val in CHAR_TO_INT.items()}
-OFFSETS = np.array([[-1, 0], [0, -1], [0, 1], [1, 0]])
+ELF = CHAR_TO_INT['E']
+GOBLIN = CHAR_TO_INT['G']
+# round, grid height, grid width, unit count, elf deaths, first elf attack
+SNAPSHOT_HEADER = struct.Struct('<6i')
+COUNTERS = None
 
 
 class Battle:
-    def __init__(self, grid, elf_power=3, debug=False):
+    # units live in parallel arrays indexed by unit id; positions are flat
+    # indices into the grid, which sort in reading order
+    def __init__(self, grid, elf_power=3, debug=False, stop_on_elf_death=False,
+                 snapshot_every=None):
         self.debug = debug
+        self.stop_on_elf_death = stop_on_elf_death
+        self.snapshot_every = snapshot_every
+        self.snapshots = {}
         self.round = 0
         self.grid = np.copy(grid)
-        elf_inds = np.where(grid == CHAR_TO_INT['E'])
-        self.elf_list = [Elf(position, self, elf_power) for position in zip(*elf_inds)]
-        goblin_inds = np.where(grid == CHAR_TO_INT['G'])
-        self.goblin_list = [Goblin(position, self) for position in zip(*goblin_inds)]
+        self.width = self.grid.shape[1]
+
+        position = np.flatnonzero((self.grid.ravel() == ELF) |
+                                  (self.grid.ravel() == GOBLIN))
+        faction = self.grid.ravel()[position]
+        self.set_units(position, faction, np.full(len(position), 200),
+                       np.where(faction == ELF, elf_power, 3),
+                       np.ones(len(position), dtype=bool))
 
         self.elf_deaths = 0
+        self.first_elf_attack_round = None
+
+    def set_units(self, position, faction, hit_points, power, alive):
+        self.cells = self.grid.ravel()
+        self.steps = (-self.width, -1, 1, self.width)
+        self.position = position
+        self.faction = faction
+        self.hit_points = hit_points
+        self.power = power
+        self.alive = alive
+        self.unit_at = np.full(len(self.cells), -1)
+        self.unit_at[position[alive]] = np.flatnonzero(alive)
+        self.n_alive = {faction: int(np.sum(alive & (self.faction == faction)))
+                        for faction in (ELF, GOBLIN)}
+        # per faction, how many of its units border each cell, and the open
+        # cells among those; kept current by move and die
+        self.adjacent = {faction: [0] * len(self.cells) for faction in (ELF, GOBLIN)}
+        self.in_range = {faction: set() for faction in (ELF, GOBLIN)}
+        for unit in np.flatnonzero(alive).tolist():
+            self.track(self.faction[unit], int(position[unit]), 1)
+
+    def snapshot(self):
+        # the grid and unit arrays packed behind a fixed-size header
+        first_elf_attack = self.first_elf_attack_round
+        header = SNAPSHOT_HEADER.pack(
+            self.round, self.grid.shape[0], self.width, len(self.position),
+            self.elf_deaths, -1 if first_elf_attack is None else first_elf_attack)
+        return b''.join((header, self.grid.astype(np.int8).tobytes(),
+                         self.position.astype(np.int32).tobytes(),
+                         self.faction.astype(np.int8).tobytes(),
+                         self.hit_points.astype(np.int32).tobytes(),
+                         self.power.astype(np.int32).tobytes(),
+                         self.alive.tobytes()))
+
+    @classmethod
+    def from_snapshot(cls, data, elf_power=None, **kwargs):
+        # resume a battle, optionally giving the elves a different power
+        (round, height, width, n_units, elf_deaths,
+         first_elf_attack) = SNAPSHOT_HEADER.unpack_from(data)
+        offset = SNAPSHOT_HEADER.size
+        arrays = []
+        for dtype, size in ((np.int8, height * width), (np.int32, n_units),
+                            (np.int8, n_units), (np.int32, n_units),
+                            (np.int32, n_units), (bool, n_units)):
+            arrays.append(np.frombuffer(data, dtype, size, offset).astype(int))
+            offset += size * np.dtype(dtype).itemsize
+        grid, position, faction, hit_points, power, alive = arrays
+        battle = cls(grid.reshape([height, width]), **kwargs)
+        if elf_power is not None:
+            power[faction == ELF] = elf_power
+        battle.set_units(position, faction, hit_points, power, alive.astype(bool))
+        battle.round = round
+        battle.elf_deaths = elf_deaths
+        battle.first_elf_attack_round = None if first_elf_attack < 0 \
+            else first_elf_attack
+        return battle
 
     def __repr__(self):
         str = 'Round %d\n' % self.round
-        creature_list = sort_creatures(self.elf_list + self.goblin_list)
-        creats_seen = 0
-        for row in self.grid:
+        for row_ind, row in enumerate(self.grid):
             str += ''.join([INT_TO_CHAR[val] for val in row]) + '   '
-            num_creats = np.sum((row == CHAR_TO_INT['E']) |
-                               (row == CHAR_TO_INT['G']))
-            if num_creats:
-                creats = creature_list[creats_seen:creats_seen + num_creats]
-                str += ', '.join([creat.__repr__() for creat in creats])
-            creats_seen += num_creats
+            row_cells = range(row_ind * self.width, (row_ind + 1) * self.width)
+            units = [self.unit_at[cell] for cell in row_cells
+                     if self.unit_at[cell] >= 0]
+            str += ', '.join(['%s(%d)' % (INT_TO_CHAR[self.faction[unit]],
+                                          self.hit_points[unit])
+                              for unit in units])
             str += '\n'
         return str
 
+    def run(self, until_round=None):
+        # fast-forward to the start of until_round, or to the end
+        while not self.done and (until_round is None or self.round < until_round):
+            self.execute_round()
+
     def execute_round(self):
         if self.debug:
             print(self)
-        creature_list = sort_creatures(self.elf_list + self.goblin_list)
-        for ind, creature in enumerate(creature_list):
-            if creature.hit_points <= 0:
+        if self.snapshot_every and self.round % self.snapshot_every == 0:
+            self.snapshots[self.round] = self.snapshot()
+        alive = np.flatnonzero(self.alive)
+        turn_order = alive[np.argsort(self.position[alive])].tolist()
+        for ind, unit in enumerate(turn_order):
+            if not self.alive[unit]:
                 continue
-            next_position = creature.get_next_move()
-            if next_position:
-                creature.move(next_position)
-            target = creature.get_attack_target()
-            if target:
-                creature.attack(target)
-            if self.done:
+            next_position = self.get_next_move(unit)
+            if next_position is not None:
+                self.move(unit, next_position)
+            target = self.get_attack_target(unit)
+            if target is not None:
+                self.attack(unit, target)
+            if self.done or (self.stop_on_elf_death and self.elf_deaths):
                 break
-        if ind == len(creature_list) - 1:
+        if ind == len(turn_order) - 1:
             self.round += 1
 
     @property
     def done(self):
-        return not self.elf_list or not self.goblin_list
+        return not self.n_alive[ELF] or not self.n_alive[GOBLIN]
 
     @property
     def outcome(self):
-        total_hit_points = np.sum([creature.hit_points for creature in
-                                   self.elf_list + self.goblin_list])
-        return self.round * total_hit_points
-
-
-def sort_creatures(creatures):
-    positions = np.array([creat.position for creat in creatures])
-    return [creatures[ind] for ind in position_argsort(positions)]
-
-
-def position_argsort(positions):
-    sort_vals = positions[:, 0] * np.max(positions) + positions[:, 1]
-    return np.argsort(sort_vals)
-
-def position_argmin(positions):
-    # positions = np.array(positions)
-    sort_vals = positions[:, 0] * np.max(positions) + positions[:, 1]
-    return np.argmin(sort_vals)
-
-
-class Creature:
-    def __init__(self, position, battle, power=3):
-        self.value = None
-        self.hit_points = 200
-        self.power = power
-        assert len(position) == 2
-        assert isinstance(position, tuple)
-        self.position = position
-
-        self.battle = battle
-
-    def __repr__(self):
-        return "%s(%d)" % (INT_TO_CHAR[self.value], self.hit_points)
-
-    def get_attack_target(self):
-        if isinstance(self, Elf):
-            targets = self.battle.goblin_list
-        else:
-            targets = self.battle.elf_list
-        target_value = targets[0].value
-        cells = get_adjacent_cells(self.battle.grid, self.position, target_value)
-        if not cells:
-            return None
-        attack_candidates = []
-        for target in targets:
-            if target.position in cells and target.hit_points > 0:
-                attack_candidates += [target]
-        if not attack_candidates:
+        return self.round * np.sum(self.hit_points[self.alive])
+
+    def get_attack_target(self, unit):
+        # weakest adjacent enemy, first in reading order on ties
+        enemy = ELF + GOBLIN - self.faction[unit]
+        position = self.position[unit]
+        target = None
+        for step in self.steps:
+            other = self.unit_at[position + step]
+            if other >= 0 and self.faction[other] == enemy and (
+                    target is None or
+                    self.hit_points[other] < self.hit_points[target]):
+                target = other
+        return target
+
+    def attack(self, unit, target):
+        if self.faction[unit] == ELF and self.first_elf_attack_round is None:
+            self.first_elf_attack_round = self.round
+        self.hit_points[target] -= self.power[unit]
+        if self.hit_points[target] <= 0:
+            self.die(target)
+
+    def move(self, unit, new_pos):
+        old_pos = int(self.position[unit])
+        assert self.cells[new_pos] == 0
+        self.cells[new_pos] = self.cells[old_pos]
+        self.cells[old_pos] = 0
+        self.unit_at[new_pos] = unit
+        self.unit_at[old_pos] = -1
+        self.position[unit] = new_pos
+        # the two cells neighbor each other, so tracking both ends also
+        # refreshes the vacated and the newly occupied cell
+        self.track(self.faction[unit], old_pos, -1)
+        self.track(self.faction[unit], new_pos, 1)
+
+    def die(self, unit):
+        position = int(self.position[unit])
+        self.alive[unit] = False
+        self.n_alive[self.faction[unit]] -= 1
+        if self.faction[unit] == ELF:
+            self.elf_deaths += 1
+        self.cells[position] = 0
+        self.unit_at[position] = -1
+        self.track(self.faction[unit], position, -1)
+        self.refresh(position)
+
+    def track(self, faction, position, change):
+        # count a unit of faction in or out of the cells around position
+        counts = self.adjacent[faction]
+        for step in self.steps:
+            counts[position + step] += change
+            self.refresh(position + step)
+
+    def refresh(self, cell):
+        is_open = self.cells[cell] == 0
+        for faction, in_range in self.in_range.items():
+            if is_open and self.adjacent[faction][cell]:
+                in_range.add(cell)
+            else:
+                in_range.discard(cell)
+
+    def get_next_move(self, unit):
+        enemy = ELF + GOBLIN - self.faction[unit]
+        position = self.position[unit]
+        # if we're already adjacent to a target, don't move
+        if self.adjacent[enemy][position]:
             return None
-        attack_candidates = sort_creatures(attack_candidates)
-        hit_points_list = [target.hit_points for target in attack_candidates]
-        ind = np.argmin(hit_points_list)
-        return attack_candidates[ind]
-
-    def attack(self, target):
-        target.hit_points -= self.power
-        if target.hit_points <= 0:
-            target.die()
-
-    def move(self, new_pos):
-        assert self.battle.grid[new_pos] == 0
-        self.battle.grid[new_pos] = self.battle.grid[self.position]
-        self.battle.grid[self.position] = 0
-        self.position = new_pos
-
-    def die(self):
-        if isinstance(self, Elf):
-            self.battle.elf_list.remove(self)
-            self.battle.elf_deaths += 1
-        else:
-            self.battle.goblin_list.remove(self)
-        self.battle.grid[self.position] = 0
-
-    def get_next_move(self):
-        if isinstance(self, Elf):
-            targets = self.battle.goblin_list
-        else:
-            targets = self.battle.elf_list
-        # check to see if we are already adjacent to a target
-        target_value = targets[0].value
-        target_cells = get_adjacent_cells(self.battle.grid, self.position, target_value)
-        if target_cells:
-            return None  # if we're adjacent, don't move
-        # otherwise, find all cells adjacent to targets and plan a move
-        in_range = set()
-        for target in targets:
-            new_cells = get_adjacent_cells(self.battle.grid, target.position)
-            in_range |= set(new_cells)
-        return self.step_and_plan(in_range)
-
-    def step_and_plan(self, destination_cells):
-        adjacent_cells = get_adjacent_cells(self.battle.grid, self.position)
-        if not adjacent_cells:
-            return None
-        distances = []
-        closest_cells = ()
-        for cell in adjacent_cells:
-            reachable_cells, distance = self.plan_path(cell, destination_cells)
-            distances += [distance]
-            if not reachable_cells:
-                closest_cells += (None,)
-                continue
-            reachable_cells = list(reachable_cells)
-            first_cell_ind = position_argmin(np.array(reachable_cells))
-            closest_cells += (reachable_cells[first_cell_ind],)
-        min_dist = np.min(distances)
-        if np.isinf(min_dist):
+        # otherwise, plan a move toward the open cells adjacent to targets
+        return self.step_toward(position, self.in_range[enemy])
+
+    def step_toward(self, position, destination_cells):
+        # one search out from the unit finds the nearest cell in range
+        # (first in reading order on ties), then one search back from that
+        # cell picks the first step
+        open_cells = (self.cells == 0).tolist()
+        reached = find_nearest(open_cells, self.width, position, destination_cells)
+        if not reached:
             return None
-
-        candidates = zip(adjacent_cells, closest_cells, distances)
-        candidates = filter(lambda tup: tup[-1] == min_dist, candidates)
-        adjacent_cells, closest_cells, _ = zip(*candidates)
-        ind = position_argmin(np.stack(closest_cells))
-        return tuple(adjacent_cells[ind])
-
-    def plan_path(self, position, destination_cells):
-        distance = 0
-        if position in destination_cells:
-            return {position}, distance
-        current_cells = {(position,)}
-        visited_cells = set()
-        while True:
-            visited_cells |= current_cells
-            distance += 1
-            next_cells = set()  # new starting positions after taking a step
-            all_reachable_cells = set()
-            for position in current_cells:
-                adjacent_cells = get_adjacent_cells(self.battle.grid, position)
-                if not adjacent_cells:
-                    continue
-                reachable_cells = set(adjacent_cells) & destination_cells
-                if reachable_cells:
-                    all_reachable_cells |= reachable_cells
-                next_cells |= set(adjacent_cells)
-            next_cells -= visited_cells
-            if all_reachable_cells:
-                return all_reachable_cells, distance  # found a way to get there
-            if not next_cells:
-                return set(), np.inf  # no path to cell in range of target
-            current_cells = next_cells
-
-
-class Elf(Creature):
-    def __init__(self, position, battle, power):
-        super().__init__(position, battle, power)
-        self.value = 1
-
-
-class Goblin(Creature):
-    def __init__(self, position, battle):
-        super().__init__(position, battle)
-        self.value = 2
-
-
-def get_adjacent_cells(grid, position, occupancy=0):
-    return [tuple(coord) for coord in position + OFFSETS
-            if grid[coord[0], coord[1]] == occupancy]
+        first_steps = {position + step for step in self.steps
+                       if open_cells[position + step]}
+        return min(find_nearest(open_cells, self.width, min(reached), first_steps))
+
+
+def find_nearest(open_cells, width, start, goals):
+    # breadth-first search over a flattened grid, returning every goal cell
+    # at the smallest distance from start
+    steps = (-width, -1, 1, width)
+    visited = [False] * len(open_cells)
+    visited[start] = True
+    frontier = [start]
+    n_expanded = 0
+    while frontier:
+        reached = [cell for cell in frontier if cell in goals]
+        if reached:
+            break
+        n_expanded += len(frontier)
+        next_frontier = []
+        for cell in frontier:
+            for step in steps:
+                neighbor = cell + step
+                if open_cells[neighbor] and not visited[neighbor]:
+                    visited[neighbor] = True
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    else:
+        reached = []
+    if COUNTERS is not None:
+        COUNTERS['p15.searches'] += 1
+        COUNTERS['p15.cells_expanded'] += n_expanded
+    return reached
 
 
 def p15a(grid, debug=False):
     battle = Battle(grid, debug=debug)
     while not battle.done:
         battle.execute_round()
-    print(battle)
-    print('Outcome:', battle.outcome)
+    if debug:
+        print(battle)
+        print('Outcome:', battle.outcome)
     return battle.outcome
 
 
-def p15b(grid, debug=False):
-    elf_power = 4
-    while elf_power < 200:
-        battle = Battle(grid, elf_power, debug)
-        while not battle.done:
-            battle.execute_round()
-            if battle.elf_deaths:
-                break
-        if not battle.elf_deaths:
-            break
-        elf_power += 1
-
+def p15b(grid, debug=False, max_workers=1):
+    elf_power, outcome = find_elf_power(grid, max_workers)
     if debug:
         battle = Battle(grid, elf_power, debug=debug)
         while not battle.done:
             battle.execute_round()
         print(battle)
         print("Elf power was", elf_power)
-    return battle.outcome
+    return outcome
+
+
+def find_elf_power(grid, max_workers=1, min_power=4, max_power=200):
+    # elves that survive at some power survive at any higher power, so
+    # gallop upward until a power wins, then narrow the gap with several
+    # powers at a time; returns (power, outcome), or (None, None) if even
+    # max_power loses. Trials run inline unless max_workers asks for a pool
+    # (None for one process per CPU)
+    n_parallel = max_workers or os.cpu_count() or 1
+    start = shared_prefix(grid)
+    losing = min_power - 1
+    winning, best_outcome = None, None
+    stride = 1
+    executor = ProcessPoolExecutor(max_workers) if n_parallel > 1 else None
+    try:
+        while winning is None or winning - losing > 1:
+            if winning is None:
+                if losing >= max_power:
+                    break
+                powers = [min(losing + stride * (ind + 1), max_power)
+                          for ind in range(n_parallel)]
+                stride *= 2
+            else:
+                gap = winning - losing
+                powers = [losing + gap * (ind + 1) // (n_parallel + 1)
+                          for ind in range(n_parallel)]
+                powers = [power for power in powers if losing < power < winning]
+            trials = iter_trials(start, sorted(set(powers)), executor)
+            for power, outcome in trials:
+                if outcome is None:
+                    losing = max(losing, power)
+                elif winning is None or power < winning:
+                    winning, best_outcome = power, outcome
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return winning, best_outcome
+
+
+def shared_prefix(grid):
+    # elf power can't matter before the first elf attack, so every trial
+    # can start from the beginning of that round
+    battle = Battle(grid)
+    snapshot = battle.snapshot()
+    while not battle.done and battle.first_elf_attack_round is None:
+        snapshot = battle.snapshot()
+        battle.execute_round()
+    return snapshot
+
+
+def iter_trials(start, powers, executor=None):
+    # (power, outcome) for each trial as it finishes; once a power wins,
+    # trials at higher powers are cancelled since they can't be the answer
+    if executor is None:
+        for power in powers:
+            yield power, run_elf_trial(start, power)
+        return
+    futures = {executor.submit(run_elf_trial, start, power): power
+               for power in powers}
+    for future in as_completed(futures):
+        if future.cancelled():
+            continue
+        power = futures[future]
+        outcome = future.result()
+        if outcome is not None:
+            for other, other_power in futures.items():
+                if other_power > power:
+                    other.cancel()
+        yield power, outcome
+
+
+def run_elf_trial(start, elf_power):
+    # outcome of a battle resumed from the start snapshot in which no elf
+    # dies, or None at the first elf death
+    battle = Battle.from_snapshot(start, elf_power, stop_on_elf_death=True)
+    while not battle.done and not battle.elf_deaths:
+        battle.execute_round()
+    return None if battle.elf_deaths else battle.outcome
+
+
+def run_batch(caves, max_workers=None):
+    # simulate many caves, given as grids, file names or a directory of
+    # map files, spreading them over a process pool
+    if isinstance(caves, str):
+        caves = sorted(glob.glob(os.path.join(caves, '*.txt')))
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(simulate_cave, caves))
+
+
+def simulate_cave(cave):
+    name = cave if isinstance(cave, str) else None
+    grid = parse_p15_input(cave) if name else cave
+    start = time.perf_counter()
+    battle = Battle(grid)
+    while not battle.done:
+        battle.execute_round()
+    winner = ELF if battle.n_alive[ELF] else GOBLIN
+    elf_power, elf_outcome = find_elf_power(grid)
+    return {
+        'name': name,
+        'rounds': battle.round,
+        'hit_points': int(np.sum(battle.hit_points[battle.alive])),
+        'winner': INT_TO_CHAR[winner],
+        'outcome': int(battle.outcome),
+        'elf_power': elf_power,
+        'elf_outcome': None if elf_outcome is None else int(elf_outcome),
+        'seconds': time.perf_counter() - start,
+    }
 
 
 def parse_p15_input(fname):
@@ -255,6 +389,9 @@ def parse_p15_input(fname):
     return grid
 
 
+PARTS = {'a': p15a, 'b': p15b}
+
+
 if __name__ == '__main__':
     part1_answers = [27730, 36334, 39514, 27755, 28944, 18740]
     for test_number, answer in zip(range(6), part1_answers):
@@ -266,8 +403,5 @@ if __name__ == '__main__':
     part2_answers = [4988, 31284, 3478, 6474, 1140]
     for test_number, answer in zip([0, 2, 3, 4, 5], part2_answers):
         test_grid = parse_p15_input("p15_test_%d.txt" % test_number)
-        if p15b(test_grid) != answer:
-            outcome = p15b(test_grid, debug=True)
-            import pdb; pdb.set_trace()
-            outcome = p15b(test_grid, debug=True)
+        assert p15b(test_grid) == answer
     print("p15b:", p15b(p15_input))
@@ -1,9 +1,14 @@
-import parse
-import pdb
+from bisect import bisect_left, bisect_right
+
 import numpy as np
 
+SAND, FLOW, WATER, CLAY = range(4)
+CHARS = np.array(['.', '|', '~', '#'])
+COUNTERS = None
+
 
 class Grid:
+    # cell states indexed [x, y]; states from WATER up hold water above them
     def __init__(self, veins, bounds):
         self.veins = veins
         self.bounds = bounds
@@ -12,7 +17,7 @@ class Grid:
 
     def __repr__(self):
         string = ''
-        for row in self.grid[-150:, :].T:
+        for row in CHARS[self.grid[-150:, :].T]:
             string += ''.join(row)
             string += '\n'
         return string
@@ -21,101 +26,358 @@ class Grid:
         string = ''
         x_start = max(x - 50, 0)
         y_start = max(y - 20, 0)
-        for row in self.grid[x_start:x + 50, y_start:y + 20].T:
+        for row in CHARS[self.grid[x_start:x + 50, y_start:y + 20].T]:
             string += ''.join(row)
             string += '\n'
         print(string)
 
     def set_up_grid(self):
-        grid_size = (self.bounds['x'][1] - self.bounds['x'][0] + 4,
-                     self.bounds['y'][1] + 1)
-        grid = np.empty(grid_size, dtype=np.str)
-        grid[:] = '.'
-        spring_loc = (self.adjust_x(500), 0)
-        grid[spring_loc] = '+'
+        # the spring's column is on the map even when no clay is near it
+        self.x_min = min(self.bounds['x'][0], 500)
+        grid_size = (max(self.bounds['x'][1], 501) - self.x_min + 4,
+                     self.bounds['y'][1])
+        grid = np.full(grid_size, SAND, dtype=np.uint8)
         for vein in self.veins:
             x_start = self.adjust_x(vein['x'][0])
             x_stop = self.adjust_x(vein['x'][1])
             y_start = vein['y'][0]
             y_stop = vein['y'][1]
-            grid[x_start:x_stop, y_start:y_stop] = '#'
+            grid[x_start:x_stop, y_start:y_stop] = CLAY
         self.grid = grid
+        self.spring = (self.adjust_x(500), 0)
 
     def adjust_x(self, x):
-        return x - self.bounds['x'][0] + 2
+        return x - self.x_min + 2
+
+    def flow(self):
+        flow_water(self)
+
+    def drop(self, x, y):
+        # mark falling water from (x, y) down; returns the row it comes to
+        # rest on, or None if it leaves the map or joins other running water
+        blocked = np.flatnonzero(self.grid[x, y:] != SAND)
+        if not len(blocked):
+            self.grid[x, y:] = FLOW
+            return None
+        stop = y + blocked[0]
+        self.grid[x, y:stop] = FLOW
+        if stop == y or self.grid[x, stop] == FLOW:
+            return None
+        return stop - 1
+
+    def spread(self, x, y):
+        # how far water on row y spreads each way from x, and whether it is
+        # stopped by a wall on that side rather than falling off an edge
+        ends = []
+        for side in (slice(x, None, -1), slice(x, None)):
+            row = self.grid[side, y]
+            below = self.grid[side, y + 1]
+            wall = first_index(row[1:] == CLAY) + 1
+            edge = first_index(below < WATER)
+            if edge < wall:
+                ends.append((edge, False))
+            else:
+                ends.append((wall - 1, True))
+        (left, left_wall), (right, right_wall) = ends
+        return x - left, left_wall, x + right, right_wall
+
+    def fill_row(self, y, left, right, state):
+        self.grid[left:right + 1, y] = state
+
+    def state(self, x, y):
+        return self.grid[x, y]
+
+    def count(self, states):
+        return int(np.sum(np.isin(self.grid[:, self.bounds['y'][0]:], states)))
+
+
+class Intervals:
+    # disjoint runs [start, end) with a state each, sorted by start; cells
+    # outside every run are sand
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.states = []
+
+    def get(self, pos):
+        ind = bisect_right(self.starts, pos) - 1
+        if ind >= 0 and self.ends[ind] > pos:
+            return self.states[ind]
+        return SAND
+
+    def next_run(self, pos):
+        # the first non-sand cell at or after pos and its state
+        ind = bisect_right(self.starts, pos) - 1
+        if ind >= 0 and self.ends[ind] > pos:
+            return pos, self.states[ind]
+        if ind + 1 < len(self.starts):
+            return self.starts[ind + 1], self.states[ind + 1]
+        return None, None
+
+    def end_before(self, pos, states=None):
+        # end of the nearest run starting before pos, of one of the given
+        # states if any are given
+        ind = bisect_left(self.starts, pos) - 1
+        while states is not None and ind >= 0 and self.states[ind] not in states:
+            ind -= 1
+        return self.ends[ind] if ind >= 0 else None
+
+    def start_after(self, pos, states=None):
+        ind = bisect_right(self.starts, pos)
+        while states is not None and ind < len(self.starts) and \
+                self.states[ind] not in states:
+            ind += 1
+        return self.starts[ind] if ind < len(self.starts) else None
+
+    def run_around(self, pos, states=None):
+        # the stretch of touching runs covering pos, of the given states
+        def joins(ind):
+            return states is None or self.states[ind] in states
+
+        ind = bisect_right(self.starts, pos) - 1
+        if ind < 0 or self.ends[ind] <= pos or not joins(ind):
+            return None
+        first = last = ind
+        while first > 0 and self.ends[first - 1] == self.starts[first] and \
+                joins(first - 1):
+            first -= 1
+        while last + 1 < len(self.starts) and \
+                self.starts[last + 1] == self.ends[last] and joins(last + 1):
+            last += 1
+        return self.starts[first], self.ends[last]
+
+    def covered(self, states):
+        return sum(end - start for start, end, state in
+                   zip(self.starts, self.ends, self.states) if state in states)
+
+    def copy(self):
+        other = Intervals()
+        other.starts, other.ends, other.states = \
+            self.starts[:], self.ends[:], self.states[:]
+        return other
+
+    def __eq__(self, other):
+        return (self.starts, self.ends, self.states) == \
+            (other.starts, other.ends, other.states)
+
+    def set(self, start, end, state):
+        # overwrite [start, end) with state, merging equal neighbours
+        lo = bisect_right(self.ends, start)
+        hi = bisect_left(self.starts, end)
+        pieces = []
+        if lo < hi and self.starts[lo] < start:
+            pieces.append([self.starts[lo], start, self.states[lo]])
+        pieces.append([start, end, state])
+        if lo < hi and self.ends[hi - 1] > end:
+            pieces.append([end, self.ends[hi - 1], self.states[hi - 1]])
+        if lo > 0 and self.ends[lo - 1] == start and self.states[lo - 1] == state:
+            lo -= 1
+            pieces.insert(0, [self.starts[lo], start, state])
+        if hi < len(self.starts) and self.starts[hi] == end and \
+                self.states[hi] == state:
+            pieces.append([end, self.ends[hi], state])
+            hi += 1
+        merged = [pieces[0]]
+        for piece in pieces[1:]:
+            if piece[2] == merged[-1][2]:
+                merged[-1][1] = piece[1]
+            else:
+                merged.append(piece)
+        self.starts[lo:hi] = [piece[0] for piece in merged]
+        self.ends[lo:hi] = [piece[1] for piece in merged]
+        self.states[lo:hi] = [piece[2] for piece in merged]
+
+
+class Layers:
+    # the contents of every row, stored once per stretch of identical rows:
+    # key k holds the Intervals shared by all rows after the previous key up
+    # to and including k, so a vein is one range update and a basin full of
+    # equal rows is a single entry
+    def __init__(self, y_max):
+        self.keys = [y_max + 1]
+        self.rows = {y_max + 1: Intervals()}
+
+    def row(self, y):
+        return self.rows[self.keys[bisect_left(self.keys, y)]]
+
+    def split(self, y):
+        # make y the last row of its stretch
+        ind = bisect_left(self.keys, y)
+        if self.keys[ind] != y:
+            self.keys.insert(ind, y)
+            self.rows[y] = self.rows[self.keys[ind + 1]].copy()
+
+    def set(self, y_start, y_stop, start, end, state):
+        # overwrite [start, end) with state on rows [y_start, y_stop)
+        self.split(y_start - 1)
+        self.split(y_stop - 1)
+        lo = bisect_left(self.keys, y_start - 1)
+        hi = bisect_left(self.keys, y_stop - 1)
+        for key in self.keys[lo + 1:hi + 1]:
+            self.rows[key].set(start, end, state)
+        # join stretches that have become equal, from the bottom up
+        for ind in range(min(hi, len(self.keys) - 2), lo - 1, -1):
+            key = self.keys[ind]
+            if self.rows[key] == self.rows[self.keys[ind + 1]]:
+                del self.rows[key]
+                del self.keys[ind]
+
+    def first_below(self, x, y, limit):
+        # the first row from y, and before limit, that isn't sand at x, and
+        # its state there
+        ind = bisect_left(self.keys, y)
+        while ind < len(self.keys) and y < limit:
+            state = self.rows[self.keys[ind]].get(x)
+            if state != SAND:
+                return y, state
+            y = self.keys[ind] + 1
+            ind += 1
+        return None, None
+
+    def stretches(self, y_start, y_stop):
+        # (first row, row count, Intervals) over rows [y_start, y_stop)
+        ind = bisect_left(self.keys, y_start)
+        while ind < len(self.keys) and y_start < y_stop:
+            key = self.keys[ind]
+            yield y_start, min(key + 1, y_stop) - y_start, self.rows[key]
+            y_start = key + 1
+            ind += 1
+
+
+class SparseGrid:
+    # the same interface as Grid, but rows live in Layers, holding clay and
+    # the water spread along rows, and each column with falling water keeps
+    # its streams as Intervals; memory follows the number of veins and of
+    # distinct rows rather than the map area or the wet area
+    def __init__(self, veins, bounds):
+        self.veins = veins
+        self.bounds = bounds
+        self.y_max = bounds['y'][1] - 1
+        self.layers = Layers(self.y_max)
+        self.columns = {}
+        self.spring = (500, 0)
+        for vein in veins:
+            self.layers.set(vein['y'][0], vein['y'][1],
+                            vein['x'][0], vein['x'][1], CLAY)
+
+    def column(self, x):
+        return self.columns.setdefault(x, Intervals())
 
     def flow(self):
-        inds = np.where(self.grid == '+')
-        x, y = inds[0][0], inds[1][0]
-        self.fall(x, y)
-
-    def fall(self, x, y):
-        fall_inds = self.grid[x, y:] == '|'
-        fall_ind = np.argmax(fall_inds) if np.any(fall_inds) \
-            else len(fall_inds) - 1
-        stop_inds = np.isin(self.grid[x, y:], ['#', '~'])
-        stop_ind = np.argmax(stop_inds) if np.any(stop_inds) \
-            else len(stop_inds) - 1
-        end_ind = np.minimum(fall_ind, stop_ind)
-        self.grid[x, y:y + end_ind] = '|'
-        # if we find running water, this water will just join it,
-        # so nothing else needs to happen
-        if fall_ind <= stop_ind:
-            return
-        # if we find clay or still water, try to fill up the clay
-        self.fill_up(x, y + end_ind - 1)
-
-    def fill_up(self, x, y):
-        wall_right = True
-        wall_left = True
-        while wall_right and wall_left:
-            wall_right = self.fill_sideways(x, y, 1)
-            wall_left = self.fill_sideways(x, y, -1)
-            y -= 1
-        if wall_right and not wall_left:
-            self.fill_sideways(x, y + 1, 1, '|')
-        if wall_left and not wall_right:
-            self.fill_sideways(x, y + 1, -1, '|')
-
-    def fill_sideways(self, x, y, direction, fill_char='~'):
-        if direction == 1:
-            start_ind = x
-            end_ind = self.adjust_x(self.bounds['x'][1] - 1)
+        flow_water(self)
+
+    def drop(self, x, y):
+        column = self.column(x)
+        stop, stop_state = column.next_run(y)
+        limit = self.y_max + 1 if stop is None else stop
+        row_stop, row_state = self.layers.first_below(x, y, limit)
+        if row_stop is not None:
+            stop, stop_state = row_stop, row_state
+        if stop is None:
+            column.set(y, self.y_max + 1, FLOW)
+            return None
+        if stop == y:
+            return None
+        column.set(y, stop, FLOW)
+        if stop_state == FLOW:
+            return None
+        return stop - 1
+
+    def spread(self, x, y):
+        # only clay stops water sideways, and only clay or settled water
+        # holds it up
+        row = self.layers.row(y)
+        floor_start, floor_end = self.layers.row(y + 1).run_around(x, (CLAY, WATER))
+        wall = row.end_before(x, (CLAY,))
+        if wall is not None and wall >= floor_start:
+            left, left_wall = wall, True
         else:
-            start_ind = x
-            end_ind = 0
-        row = self.grid[start_ind:end_ind:direction, y]
-        below = self.grid[start_ind:end_ind:direction, y + 1]
-        wall_ind = np.argmax(row == '#')
-        empty_inds = np.isin(below, ['.', '|'])
-        empty_ind = np.argmax(empty_inds) if np.any(empty_inds) \
-            else len(empty_inds) - 1
-        if (wall_ind < empty_ind) and (row[wall_ind] == '#'):
-            end_ind = start_ind + direction * wall_ind
-            self.grid[start_ind:end_ind:direction, y] = fill_char
-            return True
-        pdb.set_trace()
-        if below[empty_ind] == '.':
-            end_ind = start_ind + direction * empty_ind
-            self.grid[start_ind:end_ind:direction, y] = '|'
-            next_x = x + direction * empty_ind
-            self.fall(next_x, y)
-        return False
-
-    def sum(self):
-        return np.sum(self.grid[:, self.bounds['y'][0]:] == '~') + \
-               np.sum(self.grid[:, self.bounds['y'][0]:] == '|')
-
-
-
-def p17a(veins, bounds):
-    grid = Grid(veins, bounds)
+            left, left_wall = floor_start - 1, False
+        wall = row.start_after(x, (CLAY,))
+        if wall is not None and wall <= floor_end:
+            right, right_wall = wall - 1, True
+        else:
+            right, right_wall = floor_end, False
+        return left, left_wall, right, right_wall
+
+    def fill_row(self, y, left, right, state):
+        self.layers.set(y, y + 1, left, right + 1, state)
+
+    def state(self, x, y):
+        state = self.layers.row(y).get(x)
+        if state == SAND and x in self.columns:
+            state = self.columns[x].get(y)
+        return state
+
+    def count(self, states):
+        y_min = self.bounds['y'][0]
+        total = sum(n_rows * row.covered(states) for _, n_rows, row in
+                    self.layers.stretches(y_min, self.y_max + 1))
+        if FLOW not in states:
+            return total
+        # streams, less where they run through water spread along a row
+        for x, column in self.columns.items():
+            for start, end in zip(column.starts, column.ends):
+                start, end = max(start, y_min), min(end, self.y_max + 1)
+                for _, n_rows, row in self.layers.stretches(start, end):
+                    if row.get(x) == SAND:
+                        total += n_rows
+        return total
+
+
+def first_index(mask):
+    return np.argmax(mask) if np.any(mask) else len(mask)
+
+
+def flow_water(ground):
+    # explicit work stack of falling streams and rows to spread; a row whose
+    # edges spill is revisited once the streams below it have settled, in
+    # case they filled up to its level. The spring's own stream may fill up
+    # to the spring row, and then spreads along it
+    x, y = ground.spring
+    stack = [('fall', x, y + 1, y)]
+    n_tasks = {'fall': 0, 'spread': 0}
+    while stack:
+        task, x, y, top = stack.pop()
+        n_tasks[task] += 1
+        if task == 'fall':
+            rest = ground.drop(x, y)
+            if rest is not None:
+                stack.append(('spread', x, rest, top))
+            continue
+        left, left_wall, right, right_wall = ground.spread(x, y)
+        if left_wall and right_wall:
+            ground.fill_row(y, left, right, WATER)
+            if y - 1 >= top:
+                stack.append(('spread', x, y - 1, top))
+            continue
+        ground.fill_row(y, left, right, FLOW)
+        spills = [edge for edge, wall in ((left, left_wall), (right, right_wall))
+                  if not wall and ground.state(edge, y + 1) == SAND]
+        if spills:
+            stack.append(('spread', x, y, top))
+            for edge in spills:
+                stack.append(('fall', edge, y + 1, y + 1))
+    if COUNTERS is not None:
+        COUNTERS['p17.falls'] += n_tasks['fall']
+        COUNTERS['p17.spreads'] += n_tasks['spread']
+
+
+def p17a(veins, bounds, sparse=False):
+    grid = (SparseGrid if sparse else Grid)(veins, bounds)
     grid.flow()
-    pdb.set_trace()
-    return grid.sum()
+    return grid.count([FLOW, WATER])
+
+
+def p17b(veins, bounds, sparse=False):
+    grid = (SparseGrid if sparse else Grid)(veins, bounds)
+    grid.flow()
+    return grid.count([WATER])
 
 
 def parse_p17_input(fname):
+    import parse  # only needed here, and slow to import
+
     pattern = parse.compile('{dim1:w}={val:d}, {dim2:w}={start:d}..{stop:d}')
     veins = []
     bounds = {'x': [np.inf, -np.inf], 'y': [np.inf, -np.inf]}
@@ -134,8 +396,18 @@ def parse_p17_input(fname):
     return veins, bounds
 
 
+PARTS = {
+    'a': lambda inputs: p17a(*inputs),
+    'b': lambda inputs: p17b(*inputs),
+}
+
+
 if __name__ == '__main__':
     test_inputs = parse_p17_input("p17_test_input.txt")
     assert p17a(*test_inputs) == 57
+    assert p17b(*test_inputs) == 29
+    assert p17a(*test_inputs, sparse=True) == 57
+    assert p17b(*test_inputs, sparse=True) == 29
     inputs = parse_p17_input("p17_input.txt")
-    print(p17a(*inputs))
+    print("p17a:", p17a(*inputs))
+    print("p17b:", p17b(*inputs))
@@ -1,96 +1,152 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
 import numpy as np
-from shapely.geometry import MultiPoint, Point
-
-
-def get_cells(center, distance, grid_shape):
-    seq = np.arange(distance + 1).reshape([-1, 1])
-    deltas_pos = np.hstack((seq, seq[::-1]))
-    deltas = np.vstack((deltas_pos, -deltas_pos, deltas_pos * [-1, 1],
-                        deltas_pos * [1, -1]))
-    cells = center + deltas
-    ok_inds = np.all((cells < grid_shape) & (cells >= 0), axis=1)
-    cells = cells[ok_inds]
-    cells = np.unique(cells, axis=0)
-    return cells, np.any(~ok_inds)
-
-
-class Grid:
-    def __init__(self, coords, point_ind, buffer):
-        grid_shape = np.max(coords, axis=0) + 2 * buffer
-        values = np.zeros(np.prod(grid_shape), dtype=np.uint16)
-        inds = np.ravel_multi_index(coords.T, grid_shape)
-        values[inds] = np.arange(coords.shape[0]) + 1
-        self.grid = np.reshape(values, grid_shape)
-
-        self.point = coords[point_ind]
-        self.value = point_ind + 1
-        self.coords = np.concatenate((coords[:point_ind],
-                                      coords[point_ind + 1:]), axis=0)
-        self.fill_area()
-
-    def __repr__(self):
-        return str(self.grid.T)
-
-    def fill_area(self):
-        for distance in range(1, self.grid.shape[0]):
-            cells_to_check, hit_max = get_cells(self.point, distance, self.grid.shape)
-            if hit_max:
-                self.grid[:] = 0
-                return
-            any_belong = False
-            for cell in cells_to_check:
-                deltas = self.coords - cell
-                other_distances = np.sum(np.abs(deltas), axis=1)
-                this_cell_belongs = np.all(other_distances > distance)
-                any_belong = any_belong or this_cell_belongs
-                if this_cell_belongs:
-                    self.grid[tuple(cell)] = self.value
-            if not any_belong:
-                break
-
-    def count_area(self):
-        return np.sum(self.grid == self.value)
-
-
-def get_candidate_point_indices(coords):
-    convex_hull = MultiPoint([coord for coord in coords]).convex_hull
-    ok_inds = []
-    for point_ind, point in enumerate(coords):
-        shapely_point = Point(point)
-        if shapely_point.within(convex_hull):
-            ok_inds.append(point_ind)
-    return ok_inds
+
+COUNTERS = None
+
+
+def label_cells(coords, low=None, high=None, chunk_size=1 << 20):
+    # label each cell of the box from low to high (the bounding box of the
+    # points by default) with its nearest point, or -1 on a tie
+    low = np.min(coords, axis=0) if low is None else np.asarray(low)
+    high = np.max(coords, axis=0) if high is None else np.asarray(high)
+    grid_shape = high - low + 1
+    cells = np.indices(grid_shape).reshape([2, -1]).T + low
+    labels = np.empty(cells.shape[0], dtype=np.int32)
+    # bound the size of the cells x points distance matrix
+    rows_per_chunk = max(chunk_size // coords.shape[0], 1)
+    for start in range(0, cells.shape[0], rows_per_chunk):
+        chunk = cells[start:start + rows_per_chunk]
+        distances = np.abs(chunk[:, np.newaxis, 0] - coords[:, 0]) + \
+            np.abs(chunk[:, np.newaxis, 1] - coords[:, 1])
+        nearest = np.argmin(distances, axis=1)
+        min_distances = distances[np.arange(chunk.shape[0]), nearest]
+        tied = np.sum(distances == min_distances[:, np.newaxis], axis=1) > 1
+        labels[start:start + rows_per_chunk] = np.where(tied, -1, nearest)
+    if COUNTERS is not None:
+        COUNTERS['p6.cells_labelled'] += cells.shape[0]
+        COUNTERS['p6.distances'] += cells.shape[0] * coords.shape[0]
+    return labels.reshape(grid_shape)
+
+
+def get_candidate_point_indices(labels, n_points):
+    # moving outward from a cell on the edge of the bounding box adds the
+    # same distance to every point, so whoever owns an edge cell owns an
+    # infinite region
+    border = np.concatenate((labels[0], labels[-1], labels[:, 0], labels[:, -1]))
+    infinite = np.zeros(n_points, dtype=bool)
+    infinite[border[border >= 0]] = True
+    return np.flatnonzero(~infinite)
 
 
 def p6a(coords):
-    # ensure there is at least a minimum border of empty cells
-    # around the outermost points in case part of the area for
-    # the largest region extends past
-    buffer = np.max(np.max(coords, axis=0) - np.min(coords, axis=0)) // 2
-
-    max_area = 0
-    for point_ind in get_candidate_point_indices(coords):
-        # subtract offset from raw coordinates to account for buffer
-        offset = np.min(coords, axis=0) - buffer
-        # make the grid and populate with center points
-        grid = Grid(coords - offset, point_ind, buffer=buffer)
-        area = grid.count_area()
-        if area > max_area:
-            max_area = area
-    return max_area
+    # a region that is finite never leaves the bounding box of the points,
+    # so labelling the box once is enough to measure every finite area
+    labels = label_cells(coords)
+    areas = np.bincount(labels[labels >= 0], minlength=coords.shape[0])
+    # no finite region at all counts as an area of 0
+    return np.max(areas[get_candidate_point_indices(labels, coords.shape[0])],
+                  initial=0)
 
 
 def p6b(coords, max_distance):
-    coords -= np.min(coords, axis=0)
-    max_x, max_y = np.max(coords, axis=0)
-    x, y = np.meshgrid(np.arange(max_x), np.arange(max_y))
-    all_cells = np.stack((x, y), axis=-1).reshape([-1, 2, 1])
-    cells_tiled = np.tile(all_cells, (1, 1, coords.shape[0]))
-    n_cells = all_cells.shape[0]
-    coords_tiled = np.tile(np.expand_dims(coords, -1), (1, 1, n_cells))
-    deltas = cells_tiled - coords_tiled.T
-    total_distances = np.sum(np.abs(deltas), axis=(1, 2))
-    return np.sum(total_distances < max_distance)
+    # beyond the bounding box each step outward adds one per point, so no
+    # cell further out than this can be inside the region
+    pad = max_distance // coords.shape[0] + 1
+    low = np.min(coords, axis=0) - pad
+    high = np.max(coords, axis=0) + pad
+    x_totals = axis_distance_totals(coords[:, 0], np.arange(low[0], high[0] + 1))
+    y_totals = np.sort(axis_distance_totals(coords[:, 1],
+                                            np.arange(low[1], high[1] + 1)))
+    # for each column, count the rows that keep the total under the limit
+    counts = np.searchsorted(y_totals, max_distance - x_totals, side='left')
+    if COUNTERS is not None:
+        COUNTERS['p6.region_columns'] += len(x_totals)
+        COUNTERS['p6.region_rows'] += len(y_totals)
+    return np.sum(counts)
+
+
+def axis_distance_totals(values, positions):
+    # sum of |position - value| over all values, for each position
+    values = np.sort(values).astype(np.int64)
+    prefix = np.concatenate(([0], np.cumsum(values)))
+    n_below = np.searchsorted(values, positions, side='right')
+    below = positions * n_below - prefix[n_below]
+    above = (prefix[-1] - prefix[n_below]) - positions * (len(values) - n_below)
+    return below + above
+
+
+def p6a_tiled(coords, tile_size=1024, max_workers=None):
+    low = np.min(coords, axis=0)
+    high = np.max(coords, axis=0)
+    areas = np.zeros(coords.shape[0], dtype=np.int64)
+    infinite = np.zeros(coords.shape[0], dtype=bool)
+    with ProcessPoolExecutor(max_workers) as executor:
+        tasks = ((coords, tile, (low, high))
+                 for tile in get_tiles(low, high, tile_size))
+        for tile_areas, tile_infinite in map_tiles(
+                executor, count_tile_areas, tasks, max_workers):
+            areas += tile_areas
+            infinite |= tile_infinite
+    return np.max(areas[~infinite], initial=0)
+
+
+def count_tile_areas(coords, tile, bounds):
+    tile_low, tile_high = tile
+    labels = label_cells(coords, tile_low, tile_high)
+    areas = np.bincount(labels[labels >= 0], minlength=coords.shape[0])
+    # only the edges of the whole bounding box mark a region as infinite
+    border = []
+    for axis in range(2):
+        for side, edge in ((0, bounds[0]), (-1, bounds[1])):
+            if tile_low[axis] <= edge[axis] <= tile_high[axis]:
+                border.append(np.take(labels, side, axis=axis))
+    border = np.concatenate(border) if border else np.empty(0, dtype=int)
+    infinite = np.zeros(coords.shape[0], dtype=bool)
+    infinite[border[border >= 0]] = True
+    return areas, infinite
+
+
+def p6b_tiled(coords, max_distance, tile_size=1 << 16, max_workers=None):
+    pad = max_distance // coords.shape[0] + 1
+    low = np.min(coords, axis=0) - pad
+    high = np.max(coords, axis=0) + pad
+    with ProcessPoolExecutor(max_workers) as executor:
+        tasks = ((coords, max_distance, tile)
+                 for tile in get_tiles(low, high, tile_size))
+        return sum(map_tiles(executor, count_tile_region, tasks, max_workers))
+
+
+def count_tile_region(coords, max_distance, tile):
+    tile_low, tile_high = tile
+    x_totals = axis_distance_totals(coords[:, 0],
+                                    np.arange(tile_low[0], tile_high[0] + 1))
+    y_totals = np.sort(axis_distance_totals(
+        coords[:, 1], np.arange(tile_low[1], tile_high[1] + 1)))
+    return int(np.sum(np.searchsorted(y_totals, max_distance - x_totals)))
+
+
+def map_tiles(executor, function, tasks, max_workers=None):
+    # results in completion order, submitting a new tile only as one
+    # finishes, so at most a couple of tiles per worker are held at once
+    n_in_flight = 2 * (max_workers or os.cpu_count() or 1)
+    pending = set()
+    for args in tasks:
+        if len(pending) >= n_in_flight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(function, *args))
+    for future in wait(pending)[0]:
+        yield future.result()
+
+
+def get_tiles(low, high, tile_size):
+    for x in range(low[0], high[0] + 1, tile_size):
+        for y in range(low[1], high[1] + 1, tile_size):
+            yield (np.array([x, y]),
+                   np.minimum([x + tile_size - 1, y + tile_size - 1], high))
 
 
 def parse_p6_input(fname):
@@ -98,10 +154,16 @@ def parse_p6_input(fname):
     return output
 
 
+PARTS = {'a': lambda coords: p6a(coords),
+         'b': lambda coords: p6b(coords, 10000)}
+
+
 if __name__ == '__main__':
     test_input = parse_p6_input("p6_test_input.txt")
     assert p6a(test_input) == 17
     p6_input = parse_p6_input("p6_input.txt")
     print("p6a:", p6a(p6_input))
+    assert p6a_tiled(test_input, tile_size=3) == 17
     assert p6b(test_input, 32) == 16
+    assert p6b_tiled(test_input, 32, tile_size=5) == 16
     print("p6b:", p6b(p6_input, 10000))
@@ -1,11 +1,20 @@
-import parse
+import heapq
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import numpy as np
-import pdb
+
+COUNTERS = None
+STEP_PATTERN = re.compile(
+    rb'Step (\w+) must be finished before step (\w+) can begin\.')
 
 
 class Step:
-    def __init__(self, letter):
-        self.letter = letter
+    def __init__(self, name):
+        self.name = name
         self.prereqs = []
         self.next = []
 
@@ -21,96 +30,195 @@ class Step:
 
 def p7a(pairs):
     steps = build_dependencies(pairs)
-    candidates = sorted(find_first_steps(steps))
-    seq = ''
-    while candidates:
-        next_step = None
-        for letter in candidates:
-            step = steps[letter]
-            if set(step.prereqs) <= set(seq):
-                next_step = step
-                break
-        if not next_step:
-            pdb.set_trace()
-        candidates.remove(next_step.letter)
-        seq += next_step.letter
-        candidates = set(candidates) | set(next_step.next)
-        candidates = sorted(list(candidates))
-    return seq
+    return ''.join(topological_order(steps))
+
+
+def topological_order(steps):
+    # Kahn's algorithm, always taking the first available step in sort order
+    n_waiting = count_prereqs(steps)
+    available = find_first_steps(steps)
+    heapq.heapify(available)
+    order = []
+    while available:
+        name = heapq.heappop(available)
+        order.append(name)
+        for next_name in steps[name].next:
+            n_waiting[next_name] -= 1
+            if not n_waiting[next_name]:
+                heapq.heappush(available, next_name)
+    if COUNTERS is not None:
+        COUNTERS['p7.steps_ordered'] += len(order)
+        COUNTERS['p7.edges_released'] += sum(len(steps[name].next) for name in order)
+    if len(order) < len(steps):
+        blocked = sorted(name for name, count in n_waiting.items() if count)
+        raise ValueError('steps blocked by a dependency cycle: %s' % ', '.join(blocked))
+    return order
+
+
+def count_prereqs(steps):
+    return {name: len(step.prereqs) for name, step in steps.items()}
 
 
 def p7b(pairs, test=False):
     if test:
         n_workers = 2
-        time_delta = -64
+        base_duration = 0
     else:
         n_workers = 5
-        time_delta = -4
+        base_duration = 60
     steps = build_dependencies(pairs)
-    candidates = sorted(find_first_steps(steps))
-    seq = ''
-
-    def assign_task(time, task, all_workers):
-        for worker in all_workers:
-            if not worker['task']:
-                worker['task'] = task
-                worker['finish_time'] = time + ord(task.letter) + time_delta
-                return True
-        return False
-
-    def finish_task(all_workers):
-        all_finish_times = [worker['finish_time'] for worker in all_workers]
-        first_ind = np.argmin(all_finish_times)
-        new_time = all_finish_times[first_ind]
-        completed_letter = all_workers[first_ind]['task'].letter
-        all_workers[first_ind] = {'task': '', 'finish_time': np.inf}
-        return new_time, completed_letter
-
-    current_time = 0
-    workers = [{'task': '', 'finish_time': np.inf} for _ in range(n_workers)]
-    while candidates:
-        for letter in candidates:
-            step = steps[letter]
-            if set(step.prereqs) <= set(seq):
-                assign_task(current_time, step, workers)
-        for worker in workers:
-            if worker['task']:
-                if worker['task'].letter in candidates:
-                    candidates.remove(worker['task'].letter)
-        current_time, letter = finish_task(workers)
-        seq += letter
-        # print('Time:', current_time, 'Seq:', seq)
-        candidates = set(candidates) | set(steps[letter].next)
-        candidates = sorted(list(candidates))
-    return current_time
+    duration = partial(letter_duration, base=base_duration)
+    finish_time, _ = schedule(steps, n_workers, duration)
+    return finish_time
+
+
+def letter_duration(name, base=60):
+    return base + ord(name) - ord('A') + 1
+
+
+def schedule(steps, n_workers, duration, n_waiting=None):
+    # discrete-event simulation: idle workers pick up available steps in
+    # sort order, then time jumps to the next completion; duration is a
+    # function of the step name or a table keyed by it
+    if n_workers < 1:
+        raise ValueError('need at least one worker, got %d' % n_workers)
+    if not callable(duration):
+        duration = duration.__getitem__
+    n_waiting = dict(n_waiting or count_prereqs(steps))
+    available = find_first_steps(steps)
+    heapq.heapify(available)
+    idle = list(range(n_workers))
+    running = []
+    trace = []  # (worker, step, start, end) in start order
+    time = 0
+    n_events = 0
+    while available or running:
+        n_events += 1
+        while available and idle:
+            name = heapq.heappop(available)
+            worker = heapq.heappop(idle)
+            end = time + duration(name)
+            heapq.heappush(running, (end, worker, name))
+            trace.append((worker, name, time, end))
+        time = running[0][0]
+        # finish everything ending now before handing out more work
+        while running and running[0][0] == time:
+            _, worker, name = heapq.heappop(running)
+            heapq.heappush(idle, worker)
+            for next_name in steps[name].next:
+                n_waiting[next_name] -= 1
+                if not n_waiting[next_name]:
+                    heapq.heappush(available, next_name)
+    if COUNTERS is not None:
+        COUNTERS['p7.steps_scheduled'] += len(trace)
+        COUNTERS['p7.completion_events'] += n_events
+    if len(trace) < len(steps):
+        blocked = sorted(name for name, count in n_waiting.items() if count)
+        raise ValueError('steps blocked by a dependency cycle: %s' % ', '.join(blocked))
+    return time, trace
+
+
+def critical_path_length(steps, duration):
+    # no number of workers can finish faster than the longest chain
+    if not callable(duration):
+        duration = duration.__getitem__
+    finish_times = {}
+    for name in topological_order(steps):
+        start = max((finish_times[prereq] for prereq in steps[name].prereqs),
+                    default=0)
+        finish_times[name] = start + duration(name)
+    return max(finish_times.values(), default=0)
+
+
+def sweep_workers(steps, worker_counts, duration, max_workers=1):
+    # finish time for each worker count, stopping once more workers stop
+    # helping; counts are simulated max_workers at a time
+    lower_bound = critical_path_length(steps, duration)
+    n_waiting = count_prereqs(steps)
+    worker_counts = sorted(worker_counts)
+    finish_times = {}
+    executor = None
+    if max_workers > 1:
+        executor = ProcessPoolExecutor(max_workers, initializer=share_schedule,
+                                       initargs=(steps, duration, n_waiting))
+    try:
+        previous = None
+        for start in range(0, len(worker_counts), max_workers):
+            batch = worker_counts[start:start + max_workers]
+            if executor:
+                results = executor.map(run_shared_schedule, batch)
+            else:
+                results = (schedule(steps, n_workers, duration, n_waiting)[0]
+                           for n_workers in batch)
+            for n_workers, finish_time in zip(batch, results):
+                if previous is not None and finish_time >= previous:
+                    return lower_bound, finish_times
+                finish_times[n_workers] = previous = finish_time
+                if finish_time == lower_bound:
+                    return lower_bound, finish_times
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return lower_bound, finish_times
+
+
+shared_schedule = {}
+
+
+def share_schedule(steps, duration, n_waiting):
+    # runs once in each pool process so the graph is only sent over once
+    shared_schedule.update(steps=steps, duration=duration, n_waiting=n_waiting)
+
+
+def run_shared_schedule(n_workers):
+    return schedule(shared_schedule['steps'], n_workers,
+                    shared_schedule['duration'], shared_schedule['n_waiting'])[0]
 
 
 def build_dependencies(pairs):
-    steps = dict()
-    for pair in pairs:
-        step = steps.get(pair['step'], Step(pair['step']))
-        step.add_prereq(pair['prereq'])
-        steps[pair['step']] = step
-
-        prereq = steps.get(pair['prereq'], Step(pair['prereq']))
-        prereq.add_next(pair['step'])
-        steps[pair['prereq']] = prereq
+    names, edges = pairs
+    names = names.tolist()
+    steps = {name: Step(name) for name in names}
+    for prereq_ind, step_ind in edges.tolist():
+        steps[names[step_ind]].add_prereq(names[prereq_ind])
+        steps[names[prereq_ind]].add_next(names[step_ind])
     return steps
 
 
 def find_first_steps(steps):
-    return [step.letter for step in steps.values() if not step.prereqs]
+    return [step.name for step in steps.values() if not step.prereqs]
 
 
 def parse_p7_input(fname):
-    parse_pattern = parse.compile(
-        'Step {prereq:w} must be finished before step {step:w} can begin.')
-    step_prereq_pairs = []
-    with open(fname) as fileobj:
-        for line in fileobj:
-            result = parse_pattern.parse(line)
-            step_prereq_pairs.append(result)
-    return step_prereq_pairs
+    # returns the sorted step names and an (n, 2) array of
+    # [prereq, step] indices into them
+    with open(fname, 'rb') as fileobj:
+        matches = STEP_PATTERN.findall(fileobj.read())
+    tokens = np.array(matches, dtype=bytes).reshape(-1)
+    names, inds = np.unique(tokens, return_inverse=True)
+    edges = inds.reshape([-1, 2]).astype(np.int32)
+    return names.astype(str), edges
+
+
+def measure_parse_throughput(fname):
+    import parse
+
+    def parse_lines():
+        pattern = parse.compile(
+            'Step {prereq:w} must be finished before step {step:w} can begin.')
+        with open(fname) as fileobj:
+            return [pattern.parse(line.strip()) for line in fileobj]
+
+    n_bytes = os.path.getsize(fname)
+    rates = {}
+    for method, parser in (('parse', parse_lines), ('bulk', lambda: parse_p7_input(fname))):
+        start = time.perf_counter()
+        parser()
+        rates[method] = n_bytes / 1e6 / (time.perf_counter() - start)
+    return rates
+
+
+PARTS = {'a': p7a, 'b': p7b}
 
 
 if __name__ == '__main__':
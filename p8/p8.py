@@ -1,45 +1,157 @@
+import os
+import sys
+
 import numpy as np
 
+# the shared chunked reader lives at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunks import CHUNK_SIZE, iter_int_chunks  # noqa: E402
+
+COUNTERS = None
+
+
+class Tree:
+    # nodes are numbered in the order their headers appear; children of a
+    # node sit next to each other in self.children from child_start onward
+    def __init__(self, ints):
+        self.ints = np.asarray(ints)
+        max_nodes = len(self.ints) // 2
+        self.n_child = np.zeros(max_nodes, dtype=np.int32)
+        self.n_meta = np.zeros(max_nodes, dtype=np.int32)
+        self.parent = np.full(max_nodes, -1, dtype=np.int32)
+        self.depth = np.zeros(max_nodes, dtype=np.int32)
+        self.child_start = np.zeros(max_nodes, dtype=np.int32)
+        self.meta_start = np.zeros(max_nodes, dtype=np.int64)
+        self.children = np.zeros(max_nodes, dtype=np.int32)
+        self.n_nodes = 0
+        self.parse()
+
+    def parse(self):
+        n_read = np.zeros(len(self.n_child), dtype=np.int32)
+        next_child_slot = 0
+        cursor = 0
+        stack = []  # nodes whose children are still being read
+        while True:
+            node = self.n_nodes
+            self.n_nodes += 1
+            self.n_child[node] = self.ints[cursor]
+            self.n_meta[node] = self.ints[cursor + 1]
+            cursor += 2
+            self.child_start[node] = next_child_slot
+            next_child_slot += self.n_child[node]
+            if stack:
+                parent = stack[-1]
+                self.parent[node] = parent
+                self.depth[node] = len(stack)
+                self.children[self.child_start[parent] + n_read[parent]] = node
+                n_read[parent] += 1
+            stack.append(node)
+            # close every node whose children have all been read
+            while stack and n_read[stack[-1]] == self.n_child[stack[-1]]:
+                node = stack.pop()
+                self.meta_start[node] = cursor
+                cursor += self.n_meta[node]
+            if not stack:
+                break
+        for name in ('n_child', 'n_meta', 'parent', 'depth', 'child_start',
+                     'meta_start'):
+            setattr(self, name, getattr(self, name)[:self.n_nodes])
+        self.children = self.children[:next_child_slot]
+        if COUNTERS is not None:
+            COUNTERS['p8.nodes_parsed'] += self.n_nodes
 
-class Node:
-    def __init__(self, int_list):
-        self.n_child = int_list.pop()
-        self.n_meta = int_list.pop()
-        self.children = []
-        self.metadata = []
-        for _ in range(self.n_child):
-            self.children.append(Node(int_list))
-        for _ in range(self.n_meta):
-            self.metadata.append(int_list.pop())
+    def metadata_entries(self):
+        # the owning node and value of every metadata entry, gathered from
+        # the flat input in one go
+        owners = np.repeat(np.arange(self.n_nodes), self.n_meta)
+        first_entry = np.cumsum(self.n_meta) - self.n_meta
+        offsets = np.arange(len(owners)) - first_entry[owners]
+        return owners, self.ints[self.meta_start[owners] + offsets]
 
     def sum_metadata(self):
-        total = sum(self.metadata)
-        for child in self.children:
-            total += child.sum_metadata()
-        return total
+        return self.evaluate()[0]
 
     def calculate_value(self):
-        if not self.n_child:
-            return sum(self.metadata)
-        total = 0
-        for child_ind in self.metadata:
-            if 1 <= child_ind <= self.n_child:
-                total += self.children[child_ind - 1].calculate_value()
-        return total
+        return self.evaluate()[1]
+
+    def evaluate(self):
+        owners, metadata = self.metadata_entries()
+        metadata = metadata.astype(np.int64)
+        values = np.zeros(self.n_nodes, dtype=np.int64)
+        is_leaf = self.n_child[owners] == 0
+        np.add.at(values, owners[is_leaf], metadata[is_leaf])
+        is_ref = ~is_leaf & (metadata >= 1) & (metadata <= self.n_child[owners])
+        ref_owners = owners[is_ref]
+        ref_children = self.children[self.child_start[ref_owners] +
+                                     metadata[is_ref] - 1]
+        # resolve references deepest level first, so each child's value is
+        # final before any parent reads it, however often it is referenced
+        order = np.argsort(-self.depth[ref_owners], kind='stable')
+        ref_owners, ref_children = ref_owners[order], ref_children[order]
+        level_starts = np.flatnonzero(np.diff(self.depth[ref_owners])) + 1
+        for level_owners, level_children in zip(
+                np.split(ref_owners, level_starts),
+                np.split(ref_children, level_starts)):
+            # repeated references grow values geometrically; once a level
+            # could pass int64, carry on in Python ints
+            if values.dtype != object and len(level_children) and \
+                    np.max(values[level_children]) > \
+                    np.iinfo(np.int64).max // len(level_children):
+                values = values.astype(object)
+            np.add.at(values, level_owners, values[level_children])
+        if COUNTERS is not None:
+            COUNTERS['p8.references'] += len(ref_owners)
+            COUNTERS['p8.levels'] += len(level_starts) + 1
+        return int(np.sum(metadata)), int(values[0])
 
 
 def p8a(int_list):
-    root_node = Node(int_list[::-1])
-    return root_node.sum_metadata()
+    return Tree(int_list).sum_metadata()
 
 
 def p8b(int_list):
-    root_node = Node(int_list[::-1])
-    return root_node.calculate_value()
+    return Tree(int_list).calculate_value()
+
+
+def p8_stream(fname, chunk_size=CHUNK_SIZE):
+    # both answers in one pass over the file, keeping only the chain of
+    # open nodes: [children left to read, metadata left, child values, value]
+    metadata_total = 0
+    root_value = None
+    stack = []
+    header = []
+    for chunk in iter_int_chunks(fname, chunk_size):
+        for token in chunk.tolist():
+            if not stack or stack[-1][0]:
+                header.append(token)
+                if len(header) < 2:
+                    continue
+                if stack:
+                    stack[-1][0] -= 1
+                stack.append([header[0], header[1], [], 0])
+                header = []
+            else:
+                frame = stack[-1]
+                metadata_total += token
+                if not frame[2]:
+                    frame[3] += token
+                elif 1 <= token <= len(frame[2]):
+                    frame[3] += frame[2][token - 1]
+                frame[1] -= 1
+            while stack and not stack[-1][0] and not stack[-1][1]:
+                value = stack.pop()[3]
+                if stack:
+                    stack[-1][2].append(value)
+                else:
+                    root_value = value
+    return metadata_total, root_value
 
 
 def parse_p8_input(fname):
-    return np.loadtxt(fname, dtype=np.int16).tolist()
+    return np.loadtxt(fname, dtype=np.int32)
+
+
+PARTS = {'a': p8a, 'b': p8b}
 
 
 if __name__ == '__main__':
@@ -49,3 +161,4 @@ if __name__ == '__main__':
     print("p8a:", p8a(p8_input))
     assert p8b(test_input) == 66
     print("p8b:", p8b(p8_input))
+    assert p8_stream("p8_test_input.txt") == (138, 66)
@@ -0,0 +1,108 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def find_puzzles():
+    # every pN/pN.py in the repository, in day order
+    puzzles = [os.path.basename(os.path.dirname(path))
+               for path in glob.glob(os.path.join(REPO_DIR, 'p*', 'p*.py'))
+               if os.path.basename(path) ==
+               os.path.basename(os.path.dirname(path)) + '.py']
+    return sorted(puzzles, key=lambda puzzle: int(puzzle[1:]))
+
+
+def solve_part(puzzle, part, fname, use_cache=True, profile_dir=None):
+    # runs in a pool process; numpy and the puzzle module are only
+    # imported here, for the puzzles that were asked for
+    import loader
+
+    if profile_dir is not None:
+        import instrument
+        if puzzle not in instrument.DEFAULT_TARGETS:
+            return solve_part(puzzle, part, fname, use_cache)
+        with instrument.profiled({puzzle: instrument.DEFAULT_TARGETS[puzzle]}) \
+                as profile:
+            result = solve_part(puzzle, part, fname, use_cache)
+        result['profile'] = profile.stats()
+        with open(os.path.join(profile_dir, '%s%s.folded' % (puzzle, part)), 'w') as f:
+            f.write(profile.collapsed())
+        return result
+
+    start = time.perf_counter()
+    if use_cache:
+        parsed = loader.load_input(puzzle, fname)
+    else:
+        module = loader.import_puzzle(puzzle)
+        parsed = getattr(module, loader.LOADERS[puzzle][0])(fname)
+    load_seconds = time.perf_counter() - start
+    solve = loader.import_puzzle(puzzle).PARTS[part]
+    start = time.perf_counter()
+    answer = solve(parsed)
+    return {
+        'puzzle': puzzle,
+        'part': part,
+        'answer': answer.item() if hasattr(answer, 'item') else answer,
+        'load_seconds': load_seconds,
+        'solve_seconds': time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run puzzle solutions and print the answers as JSON.')
+    parser.add_argument('days', nargs='*',
+                        help='days to run, e.g. 7 or p7 (default: all)')
+    parser.add_argument('--parts', default='a,b', help='comma-separated parts')
+    parser.add_argument('--input', help='input file, when running one day '
+                                        '(default: pN/pN_input.txt)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always parse the input instead of using the cache')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='time the hot functions, add their stats to the '
+                             'output and write collapsed stacks to DIR')
+    args = parser.parse_args(argv)
+
+    available = find_puzzles()
+    puzzles = ['p' + day.lstrip('p') for day in args.days] or available
+    unknown = sorted(set(puzzles) - set(available))
+    if unknown:
+        parser.error('no such puzzle: %s' % ', '.join(unknown))
+    if args.input and len(puzzles) > 1:
+        parser.error('--input needs exactly one day')
+
+    profile_dir = None
+    if args.profile:
+        profile_dir = os.path.abspath(args.profile)
+        os.makedirs(profile_dir, exist_ok=True)
+    tasks = []
+    for puzzle in puzzles:
+        fname = args.input or os.path.join(REPO_DIR, puzzle, puzzle + '_input.txt')
+        for part in args.parts.split(','):
+            tasks.append((puzzle, part, os.path.abspath(fname), not args.no_cache,
+                          profile_dir))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(solve_part, *task) for task in tasks]
+        results = []
+        for task, future in zip(tasks, futures):
+            try:
+                results.append(future.result())
+            except Exception as error:
+                results.append({'puzzle': task[0], 'part': task[1],
+                                'error': '%s: %s' % (type(error).__name__, error)})
+    json.dump({'results': results, 'seconds': time.perf_counter() - start},
+              sys.stdout, indent=2)
+    print()
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())